@@ -1,15 +1,27 @@
 import dash
 from dash import html, dcc, Input, Output, State
-import pandas as pd
+from flask import request, jsonify
 import os
 import random
 import base64
+import threading
+from utils.explainer import ExplanationService
+from utils.utils import DataLogger, list_jpg_files
+from utils.persistence import ResponseWriter
 
 # Constants
 VIS_RESULT_DIR = 'data/dataset/visualization_results'
 TEST_IMAGE_DIR = 'data/dataset/train'
 CLASS_NAMES = ['Acadian_Flycatcher', 'Western_Meadowlark', 'Common_Yellowthroat', 'Gadwall', 'Henslow_Sparrow']
 TOTAL_TRIALS = len(CLASS_NAMES)
+TEST_INDEX_DIR = 'data/test_index'
+TEST_SELECTION_MODE = 'similar'  # 'similar', 'confidence' or 'random'
+TEST_CONFIDENCE_BAND = (0.3, 0.7)
+MAX_UPLOAD_BYTES = 10 * 1024 * 1024
+# 'eager' scans datasets at import, 'background' warms them in a thread, 'lazy' waits for first use
+STARTUP_MODE = os.environ.get('XAI_STARTUP_MODE', 'background')
+EVENT_LOG_DIR = 'data/logs'
+MAX_TELEMETRY_EVENTS = 200
 test_trials = []
 
 # Prepare 1 image per class, randomized
@@ -18,8 +30,7 @@ def prepare_trials():
     for class_name in CLASS_NAMES:
         folder = os.path.join(VIS_RESULT_DIR, class_name)
         if os.path.exists(folder):
-            files = os.listdir(folder)
-            jpg_files = [f for f in files if f.lower().endswith('.jpg')]
+            jpg_files = list_jpg_files(folder)
             if jpg_files:
                 selected = jpg_files[0]
                 trials.append({
@@ -32,35 +43,105 @@ def prepare_trials():
 
 #Prepare 1 image per class for testing, randomized
 def prepare_test_trials():
+    if get_test_index() is not None:
+        return prepare_indexed_test_trials()
     trials = []
     for class_name in CLASS_NAMES:
         folder = os.path.join(TEST_IMAGE_DIR, class_name)
         if os.path.exists(folder):
-            files = os.listdir(folder)
-            jpg_files = [f for f in files if f.lower().endswith('.jpg')]
+            jpg_files = list_jpg_files(folder)
             if jpg_files:
                 selected = random.choice(jpg_files)
                 trials.append({
                     'class_name': class_name,
                     'image_path': os.path.join(folder, selected),
-                    'image_name': selected
+                    'image_name': selected,
+                    'selection': 'random'
                 })
     random.shuffle(trials)
     return trials
 
+# Select test images from the precomputed index by teaching similarity or model confidence
+def prepare_indexed_test_trials():
+    test_index = get_test_index()
+    trials = []
+    for class_name in CLASS_NAMES:
+        image_id, selection = test_index.select(class_name, mode=TEST_SELECTION_MODE, band=TEST_CONFIDENCE_BAND)
+        if image_id:
+            trials.append({
+                'class_name': class_name,
+                'image_path': os.path.join(TEST_IMAGE_DIR, image_id),
+                'image_name': os.path.basename(image_id),
+                'selection': selection
+            })
+    random.shuffle(trials)
+    return trials
+
 # Encode image
 def encode_image(image_path):
     with open(image_path, 'rb') as f:
         return 'data:image/jpeg;base64,' + base64.b64encode(f.read()).decode()
 
+# Resolve a dataset image id ('<class_name>/<file>.jpg') to a path inside TEST_IMAGE_DIR
+def resolve_image_id(image_id):
+    root = os.path.realpath(TEST_IMAGE_DIR)
+    image_path = os.path.realpath(os.path.join(root, image_id))
+    if not image_path.startswith(root + os.sep) or not os.path.isfile(image_path):
+        return None
+    return image_path
+
 # Initialize app and session
 app = dash.Dash(__name__, suppress_callback_exceptions=True)
 app.title = "PIP-Net Bird Guessing App"
-user_guesses_data = []
+app.server.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_BYTES
 csv_path = "user_guesses.csv"
-if os.path.exists(csv_path):
-    user_guesses_data = pd.read_csv(csv_path).to_dict(orient='records')
-trials = prepare_trials()
+explainer = ExplanationService()
+event_logger = DataLogger(EVENT_LOG_DIR)
+response_writer = ResponseWriter(csv_path)
+_trials = None
+_test_index = None
+_test_index_loaded = False
+_trials_lock = threading.Lock()
+_test_index_lock = threading.Lock()
+
+# Phase 1 trials are scanned on first use rather than at import
+def get_trials():
+    global _trials
+    with _trials_lock:
+        if _trials is None:
+            _trials = prepare_trials()
+        return _trials
+
+# The test index pulls in numpy, so it is loaded on first use as well
+def get_test_index():
+    global _test_index, _test_index_loaded
+    with _test_index_lock:
+        if not _test_index_loaded:
+            from utils.image_index import ImageIndex
+            _test_index = ImageIndex.load(TEST_INDEX_DIR, TEST_IMAGE_DIR)
+            _test_index_loaded = True
+        return _test_index
+
+# Queue this session's records; the writer thread merges them into the CSV per user and class
+def save_user_guesses(records):
+    response_writer.enqueue(records)
+
+# This user's saved answers, including those the writer has not flushed yet
+def load_user_guesses(user_name):
+    return response_writer.get_records(user_name)
+
+# Scan datasets and import pandas ahead of the first participant
+def warm_up():
+    get_trials()
+    get_test_index()
+    import pandas
+
+if STARTUP_MODE not in ('eager', 'background', 'lazy'):
+    raise ValueError(f"XAI_STARTUP_MODE must be 'eager', 'background' or 'lazy', got {STARTUP_MODE!r}")
+if STARTUP_MODE == 'eager':
+    warm_up()
+elif STARTUP_MODE == 'background':
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
 
 # Initialize layout
 app.layout = html.Div(style={
@@ -226,7 +307,7 @@ def show_trial(index, guesses):
     if index >= TOTAL_TRIALS:
         return []
 
-    trial = trials[index]
+    trial = get_trials()[index]
     return html.Div([
         html.H4(f"Bird {index + 1} of {TOTAL_TRIALS}"),
         html.Img(src=encode_image(trial['image_path']), style={'width': '400px', 'marginBottom': '20px'}),
@@ -260,7 +341,7 @@ def show_trial(index, guesses):
 )
 def save_guess(n_clicks, selection, index, guesses, user_name):
     if index < TOTAL_TRIALS and selection:
-        trial = trials[index]
+        trial = get_trials()[index]
         guesses.append({
             "class_name": trial["class_name"],
             "image_name": trial["image_name"],
@@ -272,13 +353,7 @@ def save_guess(n_clicks, selection, index, guesses, user_name):
         if index == TOTAL_TRIALS:
             for guess in guesses:
                 guess["teaching_phase"] = ""
-            global user_guesses_data
-            user_guesses_data = guesses
-            # Write combined CSV
-            df_existing = pd.read_csv(csv_path) if os.path.exists(csv_path) else pd.DataFrame()
-            df_new = pd.DataFrame(user_guesses_data)
-            df_combined = pd.concat([df_existing, df_new]).drop_duplicates(subset=["class_name", "user_name"], keep="last")
-            df_combined.to_csv(csv_path, index=False)
+            save_user_guesses(guesses)
             return index, guesses, "✅ Thank you! Your guesses have been saved."
 
     return index, guesses, ""
@@ -371,19 +446,17 @@ def handle_phase3(to_phase3_clicks, next_clicks, selection, index, guesses, user
     elif dash.callback_context.triggered_id == 'phase3-next-btn':
         if index < len(test_trials) and selection:
             trial = test_trials[index]
-            global user_guesses_data
-            for record in user_guesses_data:
+            user_guesses = load_user_guesses(user_name)
+            for record in user_guesses:
                 if record["class_name"] == trial["class_name"]:
                     record["testing_phase_class_shown"] = trial["class_name"]
                     record["testing_phase_user_answer"] = selection
+                    record["testing_phase_image_name"] = trial["image_name"]
+                    record["testing_phase_selection"] = trial["selection"]
                     break
             index += 1
             
-            # Write combined CSV
-            df_existing = pd.read_csv(csv_path) if os.path.exists(csv_path) else pd.DataFrame()
-            df_new = pd.DataFrame(user_guesses_data)
-            df_combined = pd.concat([df_existing, df_new]).drop_duplicates(subset=["class_name", "user_name"], keep="last")
-            df_combined.to_csv(csv_path, index=False)
+            save_user_guesses(user_guesses)
             if index == len(test_trials):
                 return index, guesses, html.Div("✅ Testing phase completed!", style={
                     'color': 'white',
@@ -432,20 +505,18 @@ def handle_phase3(to_phase3_clicks, next_clicks, selection, index, guesses, user
 @app.callback(
     Output('control-phase-content', 'children'),
     Input('control-btn', 'n_clicks'),
+    State('user-name', 'data'),
     prevent_initial_call=True
 )
-def render_control_phase_all(n_clicks):
-    for record in user_guesses_data:
+def render_control_phase_all(n_clicks, user_name):
+    user_guesses = load_user_guesses(user_name)
+    for record in user_guesses:
         record["teaching_phase"] = "control"
-    # Write combined CSV
-    df_existing = pd.read_csv(csv_path) if os.path.exists(csv_path) else pd.DataFrame()
-    df_new = pd.DataFrame(user_guesses_data)
-    df_combined = pd.concat([df_existing, df_new]).drop_duplicates(subset=["class_name", "user_name"], keep="last")
-    df_combined.to_csv(csv_path, index=False)
+    save_user_guesses(user_guesses)
     children = []
     for class_name in CLASS_NAMES:
         folder = os.path.join(VIS_RESULT_DIR, class_name)
-        jpg_files = [f for f in os.listdir(folder) if f.lower().endswith('.jpg')]
+        jpg_files = list_jpg_files(folder)
         if jpg_files:
             img_path = os.path.join(folder, jpg_files[0])
             encoded = encode_image(img_path)
@@ -459,16 +530,14 @@ def render_control_phase_all(n_clicks):
 @app.callback(
     Output('treatment1-content', 'children'),
     Input('treatment1-btn', 'n_clicks'),
+    State('user-name', 'data'),
     prevent_initial_call=True
 )
-def render_treatment1_patch(n_clicks):
-    for record in user_guesses_data:
+def render_treatment1_patch(n_clicks, user_name):
+    user_guesses = load_user_guesses(user_name)
+    for record in user_guesses:
         record["teaching_phase"] = "treatment1"
-    # Write combined CSV
-    df_existing = pd.read_csv(csv_path) if os.path.exists(csv_path) else pd.DataFrame()
-    df_new = pd.DataFrame(user_guesses_data)
-    df_combined = pd.concat([df_existing, df_new]).drop_duplicates(subset=["class_name", "user_name"], keep="last")
-    df_combined.to_csv(csv_path, index=False)
+    save_user_guesses(user_guesses)
     children = []
     for class_name in CLASS_NAMES:
         class_dir = os.path.join(VIS_RESULT_DIR, class_name)
@@ -496,7 +565,7 @@ def render_treatment1_patch(n_clicks):
             ], style={'marginRight': '20px'}))
 
         # Fetch class-level image
-        jpg_files = [f for f in os.listdir(class_dir) if f.lower().endswith('.jpg')]
+        jpg_files = list_jpg_files(class_dir)
         class_img = None
         if jpg_files:
             class_img_path = os.path.join(class_dir, jpg_files[0])
@@ -516,16 +585,14 @@ def render_treatment1_patch(n_clicks):
 @app.callback(
     Output('treatment2-content', 'children'),
     Input('treatment2-btn', 'n_clicks'),
+    State('user-name', 'data'),
     prevent_initial_call=True
 )
-def render_treatment2_rectangle(n_clicks):
-    for record in user_guesses_data:
+def render_treatment2_rectangle(n_clicks, user_name):
+    user_guesses = load_user_guesses(user_name)
+    for record in user_guesses:
         record["teaching_phase"] = "treatment2"
-    # Write combined CSV
-    df_existing = pd.read_csv(csv_path) if os.path.exists(csv_path) else pd.DataFrame()
-    df_new = pd.DataFrame(user_guesses_data)
-    df_combined = pd.concat([df_existing, df_new]).drop_duplicates(subset=["class_name", "user_name"], keep="last")
-    df_combined.to_csv(csv_path, index=False)
+    save_user_guesses(user_guesses)
     children = []
     for class_name in CLASS_NAMES:
         class_dir = os.path.join(VIS_RESULT_DIR, class_name)
@@ -553,7 +620,7 @@ def render_treatment2_rectangle(n_clicks):
             ], style={'marginRight': '20px'}))
 
         # Fetch class-level image
-        jpg_files = [f for f in os.listdir(class_dir) if f.lower().endswith('.jpg')]
+        jpg_files = list_jpg_files(class_dir)
         class_img = None
         if jpg_files:
             class_img_path = os.path.join(class_dir, jpg_files[0])
@@ -580,6 +647,50 @@ def hide_phase2(n):
         return {'display': 'none'}
     return dash.no_update
 
+# On-demand local explanation for a dataset image id or an uploaded image
+@app.server.route('/explain', methods=['POST'])
+def explain_image():
+    payload = request.get_json(silent=True) if request.is_json else request.form
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Request body must be a JSON object or form data'}), 400
+    image_id = payload.get('image_id')
+    upload = request.files.get('image')
+    if upload:
+        image_bytes = upload.read()
+    elif image_id:
+        image_path = resolve_image_id(image_id)
+        if image_path is None:
+            return jsonify({'error': f'Unknown image id: {image_id}'}), 404
+        with open(image_path, 'rb') as f:
+            image_bytes = f.read()
+    else:
+        return jsonify({'error': "Provide an 'image_id' or an 'image' upload"}), 400
+
+    try:
+        explanation = explainer.explain(image_bytes)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except TimeoutError as e:
+        return jsonify({'error': str(e)}), 504
+    except (FileNotFoundError, ImportError, RuntimeError) as e:
+        return jsonify({'error': f'Explainer unavailable: {e}'}), 503
+    return jsonify(explanation)
+
+# Ingest batched browser telemetry beacons into the event log
+@app.server.route('/telemetry', methods=['POST'])
+def ingest_telemetry():
+    payload = request.get_json(force=True, silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('events'), list):
+        return '', 400
+    events = [event for event in payload['events'][:MAX_TELEMETRY_EVENTS] if isinstance(event, dict)]
+    event_logger.log_events(payload.get('session_id'), events, device=payload.get('device'))
+    return '', 204
+
+# Queue depth and flush timings of the write-behind response writer
+@app.server.route('/persistence-stats', methods=['GET'])
+def persistence_stats():
+    return jsonify(response_writer.stats())
+
 if __name__ == '__main__':
     app.run(debug=True)
 
@@ -0,0 +1,208 @@
+// Client-side latency and exposure telemetry, sent to /telemetry in batched beacons
+(function () {
+    var ENDPOINT = '/telemetry';
+    var FLUSH_INTERVAL_MS = 5000;
+    var MAX_BATCH = 20;
+
+    // Buttons whose click should be timed until the image in their target container is decoded
+    var NEXT_BUTTONS = {
+        'next-btn': {target: 'trial-content', phase: 'phase1'},
+        'to-phase3-btn': {target: 'phase3-content', phase: 'phase3'},
+        'phase3-next-btn': {target: 'phase3-content', phase: 'phase3'}
+    };
+    var GALLERIES = ['control-phase-content', 'treatment1-content', 'treatment2-content'];
+
+    var queue = [];
+    var pending = {};
+    var galleries = {};
+    var sessionId = sessionStorage.getItem('xai-session-id');
+    if (!sessionId) {
+        sessionId = Date.now().toString(36) + Math.random().toString(36).slice(2, 10);
+        sessionStorage.setItem('xai-session-id', sessionId);
+    }
+    var device = {
+        type: /Mobi|Android|iPhone|iPad/i.test(navigator.userAgent) ? 'mobile' : 'desktop',
+        user_agent: navigator.userAgent,
+        screen: window.screen.width + 'x' + window.screen.height,
+        device_memory: navigator.deviceMemory || null,
+        cores: navigator.hardwareConcurrency || null
+    };
+
+    function record(type, phase, data) {
+        data.type = type;
+        data.phase = phase;
+        data.user_name = sessionStorage.getItem('xai-user-name') || '';
+        data.page_time_ms = performance.now();
+        data.wall_time = Date.now();
+        queue.push(data);
+        if (queue.length >= MAX_BATCH) {
+            flush();
+        }
+    }
+
+    function flush() {
+        if (!queue.length) {
+            return;
+        }
+        var body = JSON.stringify({session_id: sessionId, device: device, events: queue});
+        queue = [];
+        var blob = new Blob([body], {type: 'application/json'});
+        if (!(navigator.sendBeacon && navigator.sendBeacon(ENDPOINT, blob))) {
+            fetch(ENDPOINT, {method: 'POST', body: body, keepalive: true, headers: {'Content-Type': 'application/json'}});
+        }
+    }
+
+    function currentImageSrc(containerId) {
+        var container = document.getElementById(containerId);
+        var img = container && container.querySelector('img');
+        return img ? img.src : null;
+    }
+
+    function currentFirstChild(containerId) {
+        var container = document.getElementById(containerId);
+        return container ? container.firstElementChild : null;
+    }
+
+    document.addEventListener('click', function (event) {
+        var button = event.target.closest && event.target.closest('button');
+        if (!button) {
+            return;
+        }
+        if (button.id === 'start-phase1-btn') {
+            var input = document.getElementById('user-name-input');
+            sessionStorage.setItem('xai-user-name', input ? input.value : '');
+        }
+        var spec = NEXT_BUTTONS[button.id];
+        if (spec) {
+            pending[spec.target] = {
+                button: button.id,
+                phase: spec.phase,
+                click: performance.now(),
+                response: null,
+                previousSrc: currentImageSrc(spec.target),
+                previousChild: currentFirstChild(spec.target)
+            };
+        }
+    }, true);
+
+    // Time the Dash callback response that re-renders a pending container
+    var originalFetch = window.fetch;
+    window.fetch = function (resource, init) {
+        var url = typeof resource === 'string' ? resource : (resource && resource.url) || '';
+        var promise = originalFetch.apply(this, arguments);
+        if (url.indexOf('_dash-update-component') === -1 || !init || typeof init.body !== 'string') {
+            return promise;
+        }
+        var targets = Object.keys(pending).filter(function (target) {
+            return init.body.indexOf(target + '.children') !== -1;
+        });
+        if (targets.length) {
+            promise.then(function () {
+                var now = performance.now();
+                targets.forEach(function (target) {
+                    if (pending[target] && pending[target].response === null) {
+                        pending[target].response = now;
+                    }
+                });
+            });
+        }
+        return promise;
+    };
+
+    function recordLatency(target, entry, decoded) {
+        record('next_latency', entry.phase, {
+            button: entry.button,
+            click_to_response_ms: entry.response === null ? null : entry.response - entry.click,
+            click_to_decoded_ms: decoded === null ? null : decoded - entry.click
+        });
+        if (pending[target] === entry) {
+            delete pending[target];
+        }
+    }
+
+    function checkDecoded() {
+        Object.keys(pending).forEach(function (target) {
+            var entry = pending[target];
+            if (entry.decoding) {
+                return;
+            }
+            var container = document.getElementById(target);
+            var img = container && container.querySelector('img');
+            if (img && img.src !== entry.previousSrc) {
+                entry.decoding = true;
+                img.decode().catch(function () {}).then(function () {
+                    recordLatency(target, entry, performance.now());
+                });
+            } else if (container && !img && (entry.previousSrc !== null || container.firstElementChild !== entry.previousChild)) {
+                // The last Next click renders a completion message or nothing, without an image
+                recordLatency(target, entry, null);
+            }
+        });
+    }
+
+    // Gallery exposure: time during which at least one block of a gallery is on screen
+    var visibility = new IntersectionObserver(function (entries) {
+        entries.forEach(function (entry) {
+            var gallery = galleries[entry.target.dataset.telemetryGallery];
+            var wasVisible = gallery.visible.size > 0;
+            if (entry.isIntersecting) {
+                gallery.visible.add(entry.target);
+            } else {
+                gallery.visible.delete(entry.target);
+            }
+            var isVisible = gallery.visible.size > 0;
+            if (!wasVisible && isVisible && !document.hidden) {
+                gallery.since = performance.now();
+            } else if (wasVisible && !isVisible) {
+                endExposure(gallery);
+            }
+        });
+    });
+
+    function endExposure(gallery) {
+        if (gallery.since === null) {
+            return;
+        }
+        record('gallery_exposure', 'phase2', {gallery: gallery.id, visible_ms: performance.now() - gallery.since});
+        gallery.since = null;
+    }
+
+    function bindGalleries() {
+        GALLERIES.forEach(function (id) {
+            var container = document.getElementById(id);
+            if (!container) {
+                return;
+            }
+            if (!galleries[id]) {
+                galleries[id] = {id: id, visible: new Set(), since: null};
+            }
+            Array.prototype.forEach.call(container.children, function (block) {
+                if (!block.dataset.telemetryGallery) {
+                    block.dataset.telemetryGallery = id;
+                    visibility.observe(block);
+                }
+            });
+        });
+    }
+
+    new MutationObserver(function () {
+        bindGalleries();
+        checkDecoded();
+    }).observe(document.documentElement, {childList: true, subtree: true});
+
+    document.addEventListener('visibilitychange', function () {
+        Object.keys(galleries).forEach(function (id) {
+            var gallery = galleries[id];
+            if (document.hidden) {
+                endExposure(gallery);
+            } else if (gallery.visible.size > 0) {
+                gallery.since = performance.now();
+            }
+        });
+        if (document.hidden) {
+            flush();
+        }
+    });
+    window.addEventListener('pagehide', flush);
+    setInterval(flush, FLUSH_INTERVAL_MS);
+})();
@@ -0,0 +1,90 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in a fresh interpreter so every measurement is a true cold start
+PROBE = """
+import json, time
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+client = app.app.server.test_client()
+index = client.get('/')
+layout = client.get('/_dash-layout')
+# The initial show_trial callback is where a lazy start pays for the dataset scan
+first_trial = client.post('/_dash-update-component', json={
+    'output': 'trial-content.children',
+    'outputs': {'id': 'trial-content', 'property': 'children'},
+    'inputs': [{'id': 'trial-index', 'property': 'data', 'value': 0}],
+    'state': [{'id': 'guesses', 'property': 'data', 'value': []}],
+    'changedPropIds': []
+})
+t2 = time.perf_counter()
+print(json.dumps({
+    'import_ms': (t1 - t0) * 1000,
+    'first_response_ms': (t2 - t0) * 1000,
+    'status': [index.status_code, layout.status_code, first_trial.status_code]
+}))
+"""
+
+
+def run_probe(startup_mode):
+    """Import the app in a new process and time the import and first page load"""
+    env = dict(os.environ, XAI_STARTUP_MODE=startup_mode)
+    result = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=APP_DIR, env=env,
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(startup_mode, top=10):
+    """Return the modules with the largest cumulative import time (python -X importtime)"""
+    env = dict(os.environ, XAI_STARTUP_MODE=startup_mode)
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=APP_DIR, env=env,
+        capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        rows.append((int(cumulative), name))
+    return sorted(rows, reverse=True)[:top]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure app import time and time to first response')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--mode', default='background', choices=['eager', 'background', 'lazy'])
+    parser.add_argument('--max_import_ms', type=float, default=None, help='Fail if the median import time exceeds this')
+    parser.add_argument('--max_first_response_ms', type=float, default=None, help='Fail if the median time to first response exceeds this')
+    args = parser.parse_args()
+
+    samples = [run_probe(args.mode) for _ in range(args.runs)]
+    import_ms = statistics.median(s['import_ms'] for s in samples)
+    first_response_ms = statistics.median(s['first_response_ms'] for s in samples)
+    print(f"Startup mode: {args.mode} ({args.runs} runs)")
+    print(f"Median import time: {import_ms:.1f} ms")
+    print(f"Median time to first response: {first_response_ms:.1f} ms")
+    statuses = samples[-1]['status']
+    if any(status != 200 for status in statuses):
+        print(f"Warning: page, layout and first trial returned {statuses}; is the dataset in place?")
+    print("Slowest imports (cumulative us):")
+    for cumulative, name in slowest_imports(args.mode):
+        print(f"  {cumulative:>10}  {name}")
+
+    failed = False
+    if args.max_import_ms is not None and import_ms > args.max_import_ms:
+        print(f"FAIL: import time {import_ms:.1f} ms exceeds {args.max_import_ms:.1f} ms")
+        failed = True
+    if args.max_first_response_ms is not None and first_response_ms > args.max_first_response_ms:
+        print(f"FAIL: time to first response {first_response_ms:.1f} ms exceeds {args.max_first_response_ms:.1f} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,308 @@
+import os
+import io
+import json
+import time
+import queue
+import base64
+import hashlib
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+# Constants
+CHECKPOINT_PATH = 'data/checkpoints/net_trained'
+CLASSES_FILE = 'data/checkpoints/classes.txt'
+EXPLANATION_CACHE_DIR = 'data/explanation_cache'
+IMAGE_SIZE = 224
+PATCH_SIZE = 32
+TOP_K = 5
+MAX_BATCH_SIZE = 8
+BATCH_WINDOW_S = 0.02
+MEMORY_CACHE_SIZE = 256
+REQUEST_TIMEOUT_S = 60
+MEAN = (0.485, 0.456, 0.406)
+STD = (0.229, 0.224, 0.225)
+
+
+def hash_bytes(data):
+    """SHA-256 hex digest of raw bytes"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encode_png(image):
+    """Encode a PIL image as a PNG data URI"""
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return 'data:image/png;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def load_class_names(classes_file=CLASSES_FILE):
+    """Read CUB-style class names ('1 001.Black_footed_Albatross' per line)"""
+    if not os.path.exists(classes_file):
+        return None
+    with open(classes_file) as f:
+        names = [line.split()[-1] for line in f if line.strip()]
+    return [name.split('.', 1)[-1] for name in names]
+
+
+def load_pipnet(checkpoint_path=CHECKPOINT_PATH, num_classes=200, net='convnext_tiny_26'):
+    """Build PIP-Net and load a trained checkpoint on CPU"""
+    import torch
+    from pipnet.pipnet import PIPNet, get_network
+
+    args = argparse.Namespace(net=net, num_features=0, bias=False, disable_pretrained=True)
+    feature_net, add_on_layers, pool_layer, classification_layer, num_prototypes = get_network(num_classes, args)
+    model = PIPNet(
+        num_classes=num_classes,
+        num_prototypes=num_prototypes,
+        feature_net=feature_net,
+        args=args,
+        add_on_layers=add_on_layers,
+        pool_layer=pool_layer,
+        classification_layer=classification_layer
+    )
+    checkpoint = torch.load(checkpoint_path, map_location='cpu')
+    # Checkpoints are saved from nn.DataParallel, strip the 'module.' prefix
+    state_dict = {k.replace('module.', '', 1): v for k, v in checkpoint['model_state_dict'].items()}
+    model.load_state_dict(state_dict, strict=True)
+    model.eval()
+    return model
+
+
+def get_img_coordinates(img_size, wshape, h_idx, w_idx, patchsize=PATCH_SIZE):
+    """Map a latent location to pixel coordinates of its image patch"""
+    skip = round((img_size - patchsize) / (wshape - 1))
+    h_min = h_idx * skip
+    w_min = w_idx * skip
+    return h_min, min(img_size, h_min + patchsize), w_min, min(img_size, w_min + patchsize)
+
+
+class ExplanationCache:
+    def __init__(self, cache_dir=EXPLANATION_CACHE_DIR, max_items=MEMORY_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_items = max_items
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        checkpoint_hash, image_hash = key
+        return os.path.join(self.cache_dir, checkpoint_hash[:16], f'{image_hash}.json')
+
+    def get(self, key):
+        """Look up an explanation in memory first, then on disk"""
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return self._items[key]
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path) as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            # A truncated or unreadable entry is treated as a miss and rewritten later
+            return None
+        self._remember(key, value)
+        return value
+
+    def put(self, key, value):
+        """Store an explanation in memory and persist it to disk"""
+        self._remember(key, value)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp_path, path)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+
+class MicroBatcher:
+    def __init__(self, run_batch, max_batch_size=MAX_BATCH_SIZE, max_wait=BATCH_WINDOW_S):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name='explainer-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queue one item and return a Future for its result"""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # Collect whatever else arrives within the batching window
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            items = [item for item, _ in batch]
+            try:
+                results = self.run_batch(items)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class ExplanationService:
+    def __init__(self, checkpoint_path=CHECKPOINT_PATH, cache_dir=EXPLANATION_CACHE_DIR, top_k=TOP_K):
+        self.checkpoint_path = checkpoint_path
+        self.top_k = top_k
+        self.cache = ExplanationCache(cache_dir)
+        self.model = None
+        self.class_names = None
+        self.checkpoint_hash = None
+        self._batcher = None
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        # Load the model on first use so that importing the app stays cheap
+        with self._load_lock:
+            if self.model is not None:
+                return
+            if not os.path.exists(self.checkpoint_path):
+                raise FileNotFoundError(f'PIP-Net checkpoint not found: {self.checkpoint_path}')
+            self.class_names = load_class_names()
+            num_classes = len(self.class_names) if self.class_names else 200
+            self.model = load_pipnet(self.checkpoint_path, num_classes=num_classes)
+            self.checkpoint_hash = hash_file(self.checkpoint_path)
+            self._batcher = MicroBatcher(self._run_batch)
+
+    def explain(self, image_bytes):
+        """Return the top prototypes explaining the model's prediction for an image"""
+        from PIL import Image
+
+        self._ensure_loaded()
+        key = (self.checkpoint_hash, hash_bytes(image_bytes))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        try:
+            image = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+        except OSError:
+            raise ValueError('Uploaded file is not a readable image')
+        except Image.DecompressionBombError:
+            raise ValueError('Uploaded image is too large')
+
+        future = self._submit(key, image)
+        try:
+            return future.result(timeout=REQUEST_TIMEOUT_S)
+        except FutureTimeoutError:
+            raise TimeoutError(f'No explanation within {REQUEST_TIMEOUT_S} s')
+        except Exception as e:
+            raise RuntimeError(f'Explanation batch failed: {e}') from e
+
+    def _submit(self, key, image):
+        # Concurrent requests for the same image share one forward pass
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            is_new = future is None
+            if is_new:
+                future = self._batcher.submit((key, image))
+                self._inflight[key] = future
+        if is_new:
+            future.add_done_callback(lambda f: self._finish(key, f))
+        return future
+
+    def _finish(self, key, future):
+        with self._inflight_lock:
+            self._inflight.pop(key, None)
+        if future.exception() is None:
+            self.cache.put(key, future.result())
+
+    def _forward(self, images):
+        import torch
+        from torchvision import transforms
+
+        resize = transforms.Resize(size=(IMAGE_SIZE, IMAGE_SIZE))
+        normalize = transforms.Compose([transforms.ToTensor(), transforms.Normalize(mean=MEAN, std=STD)])
+        images = [resize(image) for image in images]
+        xs = torch.stack([normalize(image) for image in images])
+        with torch.no_grad():
+            proto_features, pooled, out = self.model(xs, inference=True)
+        return images, proto_features, pooled, out
+
+    def embed(self, image_paths):
+        """Return prototype presence vectors and class scores for a batch of image files"""
+        from PIL import Image
+
+        self._ensure_loaded()
+        images = [Image.open(path).convert('RGB') for path in image_paths]
+        _, _, pooled, out = self._forward(images)
+        return pooled.numpy(), out.numpy()
+
+    def _run_batch(self, items):
+        images, proto_features, pooled, out = self._forward([image for _, image in items])
+        weights = self.model._classification.weight
+        return [
+            self._build_explanation(key, image, proto_features[i], pooled[i], out[i], weights)
+            for i, ((key, _), image) in enumerate(zip(items, images))
+        ]
+
+    def _build_explanation(self, key, image, proto_features, pooled, out, weights):
+        from PIL import ImageDraw
+
+        pred_idx = int(out.argmax().item())
+        simweights = pooled * weights[pred_idx]
+        top = [p for p in simweights.argsort(descending=True)[:self.top_k].tolist() if simweights[p].item() > 0]
+
+        prototypes = []
+        for p in top:
+            # Location of the strongest activation of this prototype in the latent map
+            feature_map = proto_features[p]
+            flat_idx = int(feature_map.argmax().item())
+            h_idx, w_idx = divmod(flat_idx, feature_map.shape[1])
+            h_min, h_max, w_min, w_max = get_img_coordinates(IMAGE_SIZE, feature_map.shape[1], h_idx, w_idx)
+
+            rect = image.copy()
+            ImageDraw.Draw(rect).rectangle([(w_min, h_min), (w_max, h_max)], outline='yellow', width=2)
+            prototypes.append({
+                'prototype': p,
+                'mul': round(simweights[p].item(), 3),
+                'similarity': round(pooled[p].item(), 3),
+                'weight': round(weights[pred_idx, p].item(), 3),
+                'patch': encode_png(image.crop((w_min, h_min, w_max, h_max))),
+                'rect': encode_png(rect)
+            })
+
+        checkpoint_hash, image_hash = key
+        return {
+            'image_hash': image_hash,
+            'checkpoint_hash': checkpoint_hash,
+            'predicted_class_index': pred_idx,
+            'predicted_class': self.class_names[pred_idx] if self.class_names else str(pred_idx),
+            'score': round(out[pred_idx].item(), 3),
+            'prototypes': prototypes
+        }
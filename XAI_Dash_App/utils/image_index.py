@@ -0,0 +1,179 @@
+import os
+import json
+import random
+import argparse
+import numpy as np
+from utils.explainer import CHECKPOINT_PATH, hash_file
+from utils.utils import list_jpg_files
+
+# Constants
+TEST_INDEX_DIR = 'data/test_index'
+FEATURES_FILE = 'features.npy'
+TEACHING_FILE = 'teaching.npy'
+META_FILE = 'index.json'
+BATCH_SIZE = 16
+
+
+def list_class_images(root, class_names):
+    """List image ids ('<class_name>/<file>.jpg') per class under a dataset folder"""
+    image_ids = {}
+    for class_name in class_names:
+        folder = os.path.join(root, class_name)
+        if not os.path.exists(folder):
+            continue
+        # The first file is the teaching image, matching what app.py shows
+        image_ids[class_name] = [f'{class_name}/{f}' for f in list_jpg_files(folder)]
+    return image_ids
+
+
+def _softmax(scores):
+    scores = scores - scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _class_confidence(probs, class_name, class_names):
+    # Probability of the true class if the model knows it, otherwise of the top prediction
+    if class_names and class_name in class_names:
+        return probs[:, class_names.index(class_name)]
+    return probs.max(axis=1)
+
+
+def build_index(explainer, test_dir, teaching_dir, class_names, index_dir=TEST_INDEX_DIR, batch_size=BATCH_SIZE):
+    """Embed the test pool and teaching images and store them as a memmapped index"""
+    os.makedirs(index_dir, exist_ok=True)
+    test_ids = list_class_images(test_dir, class_names)
+    teaching_ids = {c: ids[0] for c, ids in list_class_images(teaching_dir, class_names).items() if ids}
+
+    # Rows are grouped by class so each class is one contiguous slice of the memmap
+    ordered = [(c, image_id) for c in class_names for image_id in test_ids.get(c, [])]
+    features = None
+    confidence = []
+    predicted = []
+    classes = {}
+    for start in range(0, len(ordered), batch_size):
+        batch = ordered[start:start + batch_size]
+        pooled, out = explainer.embed([os.path.join(test_dir, image_id) for _, image_id in batch])
+        if features is None:
+            features = np.lib.format.open_memmap(
+                os.path.join(index_dir, FEATURES_FILE), mode='w+', dtype=np.float32,
+                shape=(len(ordered), pooled.shape[1])
+            )
+        features[start:start + len(batch)] = _normalize(pooled)
+        probs = _softmax(out)
+        predicted.extend(int(i) for i in out.argmax(axis=1))
+        for i, (class_name, _) in enumerate(batch):
+            confidence.append(float(_class_confidence(probs[i:i + 1], class_name, explainer.class_names)[0]))
+    if features is None:
+        # Without features the index is unusable, so do not leave a meta file pointing at one
+        raise ValueError(f'No test images found under {test_dir} for {class_names}')
+    features.flush()
+    row = 0
+    for class_name in class_names:
+        count = len(test_ids.get(class_name, []))
+        if count:
+            classes[class_name] = [row, row + count]
+        row += count
+
+    teaching_classes = list(teaching_ids)
+    if teaching_classes:
+        pooled, _ = explainer.embed([os.path.join(teaching_dir, teaching_ids[c]) for c in teaching_classes])
+        np.save(os.path.join(index_dir, TEACHING_FILE), _normalize(pooled).astype(np.float32))
+
+    meta = {
+        'checkpoint_hash': explainer.checkpoint_hash,
+        'image_ids': [image_id for _, image_id in ordered],
+        'classes': classes,
+        'confidence': confidence,
+        'predicted_class_index': predicted,
+        'teaching_ids': [teaching_ids[c] for c in teaching_classes],
+        'teaching_classes': teaching_classes
+    }
+    with open(os.path.join(index_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+    return meta
+
+
+class ImageIndex:
+    def __init__(self, index_dir=TEST_INDEX_DIR):
+        self.index_dir = index_dir
+        with open(os.path.join(index_dir, META_FILE)) as f:
+            meta = json.load(f)
+        self.checkpoint_hash = meta.get('checkpoint_hash')
+        self.features = np.load(os.path.join(index_dir, FEATURES_FILE), mmap_mode='r')
+        self.image_ids = meta['image_ids']
+        self.classes = {c: tuple(bounds) for c, bounds in meta['classes'].items()}
+        self.confidence = np.asarray(meta['confidence'], dtype=np.float32)
+        teaching_path = os.path.join(index_dir, TEACHING_FILE)
+        self.teaching = np.load(teaching_path) if os.path.exists(teaching_path) else None
+        self.teaching_rows = {c: i for i, c in enumerate(meta.get('teaching_classes', []))}
+        # Never test on the exact image the participant was taught with
+        teaching_names = {os.path.basename(image_id) for image_id in meta.get('teaching_ids', [])}
+        self.selectable = np.array([os.path.basename(image_id) not in teaching_names for image_id in self.image_ids], dtype=bool)
+
+    @classmethod
+    def load(cls, index_dir=TEST_INDEX_DIR, test_dir=None, checkpoint_path=CHECKPOINT_PATH):
+        """Load the index if it is complete and up to date, otherwise return None"""
+        if not all(os.path.exists(os.path.join(index_dir, name)) for name in (META_FILE, FEATURES_FILE)):
+            return None
+        try:
+            index = cls(index_dir)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable test index in {index_dir}: {e}")
+            return None
+        if os.path.exists(checkpoint_path) and index.checkpoint_hash != hash_file(checkpoint_path):
+            print(f"Ignoring test index in {index_dir}: it was built with a different checkpoint")
+            return None
+        if test_dir is not None:
+            missing = [i for i in index.image_ids if not os.path.isfile(os.path.join(test_dir, i))]
+            if missing:
+                print(f"Ignoring test index in {index_dir}: {len(missing)} indexed images are missing from {test_dir}")
+                return None
+        return index
+
+    def select(self, class_name, mode='similar', top_k=5, band=(0.3, 0.7), rng=random):
+        """Pick a test image id for a class; returns (image_id, selection mode actually used)"""
+        if class_name not in self.classes:
+            return None, None
+        start, end = self.classes[class_name]
+        rows = np.flatnonzero(self.selectable[start:end]) + start
+        if len(rows) == 0:
+            return None, None
+
+        # Without a teaching vector 'similar' falls back to a uniform pick
+        effective_mode = 'random'
+        candidates = rows
+        if mode == 'similar' and self.teaching is not None and class_name in self.teaching_rows:
+            sims = self.features[start:end] @ self.teaching[self.teaching_rows[class_name]]
+            sims = sims[rows - start]
+            candidates = rows[np.argsort(-sims)[:top_k]]
+            effective_mode = 'similar'
+        elif mode == 'confidence':
+            conf = self.confidence[rows]
+            candidates = rows[(conf >= band[0]) & (conf < band[1])]
+            effective_mode = 'confidence'
+            if len(candidates) == 0:
+                # Fall back to the images closest to the band
+                centre = (band[0] + band[1]) / 2
+                candidates = rows[np.argsort(np.abs(conf - centre))[:top_k]]
+                effective_mode = 'confidence_nearest'
+        return self.image_ids[int(rng.choice(list(candidates)))], effective_mode
+
+
+if __name__ == '__main__':
+    from utils.explainer import ExplanationService
+
+    parser = argparse.ArgumentParser(description='Build the Phase 3 test image index')
+    parser.add_argument('--test_dir', default='data/dataset/train')
+    parser.add_argument('--teaching_dir', default='data/dataset/visualization_results')
+    parser.add_argument('--index_dir', default=TEST_INDEX_DIR)
+    parser.add_argument('--classes', nargs='+', required=True)
+    args = parser.parse_args()
+
+    meta = build_index(ExplanationService(), args.test_dir, args.teaching_dir, args.classes, args.index_dir)
+    print(f"Indexed {len(meta['image_ids'])} test images for {len(meta['classes'])} classes in {args.index_dir}")
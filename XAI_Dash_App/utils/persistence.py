@@ -0,0 +1,178 @@
+import os
+import time
+import queue
+import atexit
+import threading
+
+# Constants
+FLUSH_INTERVAL_S = 0.5
+MAX_QUEUE_SIZE = 1000
+ENQUEUE_TIMEOUT_S = 0.05
+KEY_COLUMNS = ['class_name', 'user_name']
+
+
+class ResponseWriter:
+    def __init__(self, csv_path, flush_interval=FLUSH_INTERVAL_S, max_queue_size=MAX_QUEUE_SIZE, enqueue_timeout=ENQUEUE_TIMEOUT_S):
+        self.csv_path = csv_path
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        # key -> (seq, record); drained from the queue but not yet on disk
+        self._unflushed = {}
+        # key -> (seq, record); everything enqueued but not yet on disk, for read-your-writes
+        self._pending = {}
+        self._seq = 0
+        # user_name -> {key: record}; the CSV rows this process has flushed or loaded
+        self._table = {}
+        # _table and _pending change together under this lock so readers never miss a record
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stats = {
+            'flushes': 0,
+            'records_written': 0,
+            'last_flush_ms': None,
+            'max_flush_ms': 0.0,
+            'total_flush_ms': 0.0,
+            'blocked_enqueues': 0,
+            'errors': 0,
+            'last_error': None
+        }
+        self._thread = threading.Thread(target=self._run, name='response-writer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def _key(record):
+        return tuple(record.get(column) for column in KEY_COLUMNS)
+
+    def enqueue(self, records):
+        """Queue a snapshot of response records for the writer thread"""
+        records = [dict(record) for record in records]
+        with self._pending_lock:
+            self._seq += 1
+            seq = self._seq
+            for record in records:
+                self._pending[self._key(record)] = (seq, record)
+        try:
+            self._queue.put((seq, records), timeout=self.enqueue_timeout)
+        except queue.Full:
+            # Back-pressure: write from the caller rather than drop answers
+            with self._stats_lock:
+                self._stats['blocked_enqueues'] += 1
+            self.flush()
+            self._queue.put((seq, records))
+
+    def get_records(self, user_name):
+        """Records for one user as stored in the CSV, overlaid with writes still queued"""
+        records = self._snapshot(user_name)
+        if not records:
+            # Nothing seen for this user in this process yet, e.g. after a restart
+            rows = {self._key(row): row for row in self._read_rows(user_name)}
+            with self._pending_lock:
+                if rows and user_name not in self._table:
+                    self._table[user_name] = rows
+            records = self._snapshot(user_name)
+        return list(records.values())
+
+    def _snapshot(self, user_name):
+        with self._pending_lock:
+            records = {key: dict(record) for key, record in self._table.get(user_name, {}).items()}
+            for key, (_, record) in self._pending.items():
+                if record.get('user_name') == user_name:
+                    records[key] = dict(record)
+        return records
+
+    def _read_rows(self, user_name):
+        import pandas as pd
+
+        if not os.path.exists(self.csv_path):
+            return []
+        df = pd.read_csv(self.csv_path, dtype={'user_name': str, 'class_name': str})
+        if 'user_name' not in df.columns:
+            return []
+        df = df[df['user_name'] == user_name].astype(object)
+        return df.where(pd.notna(df), None).to_dict(orient='records')
+
+    def flush(self):
+        """Write everything queued so far to the CSV file"""
+        with self._flush_lock:
+            while True:
+                try:
+                    seq, records = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                # Batches can reach the queue out of order, so only a newer seq replaces a record
+                for record in records:
+                    key = self._key(record)
+                    current = self._unflushed.get(key)
+                    if current is None or seq >= current[0]:
+                        self._unflushed[key] = (seq, record)
+            if not self._unflushed:
+                return
+
+            start = time.perf_counter()
+            try:
+                rows = self._write([record for _, record in self._unflushed.values()])
+            except Exception as e:
+                # Keep the batch and retry on the next interval
+                with self._stats_lock:
+                    self._stats['errors'] += 1
+                    self._stats['last_error'] = repr(e)
+                return
+            elapsed_ms = (time.perf_counter() - start) * 1000
+
+            written = self._unflushed
+            self._unflushed = {}
+            table = {}
+            for row in rows:
+                table.setdefault(row.get('user_name'), {})[self._key(row)] = row
+            with self._pending_lock:
+                self._table = table
+                for key, (seq, _) in written.items():
+                    if key in self._pending and self._pending[key][0] <= seq:
+                        del self._pending[key]
+            with self._stats_lock:
+                self._stats['flushes'] += 1
+                self._stats['records_written'] += len(written)
+                self._stats['last_flush_ms'] = elapsed_ms
+                self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed_ms)
+                self._stats['total_flush_ms'] += elapsed_ms
+
+    def _write(self, records):
+        """Merge records into the CSV and return all of its rows"""
+        import pandas as pd
+
+        # Re-read on every flush so rows written by other processes or by hand are kept
+        existing = pd.read_csv(self.csv_path, dtype={'user_name': str, 'class_name': str}) if os.path.exists(self.csv_path) else pd.DataFrame()
+        table = pd.concat([existing, pd.DataFrame(records)]).drop_duplicates(subset=KEY_COLUMNS, keep='last')
+        tmp_path = self.csv_path + '.tmp'
+        with open(tmp_path, 'w', newline='') as f:
+            table.to_csv(f, index=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.csv_path)
+        table = table.astype(object)
+        return table.where(pd.notna(table), None).to_dict(orient='records')
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def close(self):
+        """Stop the writer thread and flush whatever is still queued"""
+        self._stop.set()
+        self._thread.join(timeout=5)
+        self.flush()
+
+    def stats(self):
+        """Queue depth and flush timing of the writer"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        total_ms = stats.pop('total_flush_ms')
+        stats['mean_flush_ms'] = total_ms / stats['flushes'] if stats['flushes'] else None
+        stats['queue_depth'] = self._queue.qsize()
+        with self._pending_lock:
+            stats['pending_records'] = len(self._pending)
+        return stats
@@ -0,0 +1,117 @@
+import io
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from utils.explainer import ExplanationService, MicroBatcher
+
+
+def submit_concurrently(batcher, items):
+    futures = [None] * len(items)
+
+    def submit(i):
+        futures[i] = batcher.submit(items[i])
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(len(items))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return futures
+
+
+def test_concurrent_submits_are_grouped_into_one_batch():
+    batches = []
+
+    def run_batch(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher(run_batch, max_batch_size=8, max_wait=0.5)
+    futures = submit_concurrently(batcher, [1, 2, 3, 4])
+
+    assert sorted(f.result(timeout=5) for f in futures) == [10, 20, 30, 40]
+    assert len(batches) == 1
+    assert sorted(batches[0]) == [1, 2, 3, 4]
+
+
+def test_batches_respect_max_batch_size():
+    batches = []
+
+    def run_batch(items):
+        batches.append(list(items))
+        return items
+
+    batcher = MicroBatcher(run_batch, max_batch_size=2, max_wait=0.5)
+    futures = submit_concurrently(batcher, [1, 2, 3, 4, 5])
+
+    assert sorted(f.result(timeout=5) for f in futures) == [1, 2, 3, 4, 5]
+    assert all(len(batch) <= 2 for batch in batches)
+
+
+def test_batch_failure_reaches_every_waiting_future():
+    def run_batch(items):
+        raise RuntimeError('model exploded')
+
+    batcher = MicroBatcher(run_batch, max_batch_size=8, max_wait=0.5)
+    futures = submit_concurrently(batcher, [1, 2, 3])
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match='model exploded'):
+            future.result(timeout=5)
+
+
+def test_identical_inflight_requests_share_one_submission(tmp_path):
+    class FakeBatcher:
+        def __init__(self):
+            self.submitted = []
+            self.future = Future()
+
+        def submit(self, item):
+            self.submitted.append(item)
+            return self.future
+
+    service = ExplanationService(cache_dir=str(tmp_path))
+    service._batcher = FakeBatcher()
+    key = ('checkpoint', 'image')
+
+    first = service._submit(key, 'image-a')
+    second = service._submit(key, 'image-b')
+
+    assert first is second
+    assert len(service._batcher.submitted) == 1
+    service._batcher.future.set_result({'prototypes': []})
+    assert service._inflight == {}
+    assert service.cache.get(key) == {'prototypes': []}
+
+
+def test_unreadable_cache_file_is_a_miss(tmp_path):
+    service = ExplanationService(cache_dir=str(tmp_path))
+    key = ('checkpoint-hash', 'image-hash')
+    path = service.cache._path(key)
+    (tmp_path / 'checkpoint-hash').mkdir()
+    with open(path, 'w') as f:
+        f.write('{"prototypes": [')
+
+    assert service.cache.get(key) is None
+
+
+@pytest.mark.parametrize('image_bytes, message', [
+    (b'not an image', 'not a readable image'),
+    (None, 'too large'),
+])
+def test_unusable_uploads_raise_value_error(tmp_path, monkeypatch, image_bytes, message):
+    Image = pytest.importorskip('PIL.Image')
+    if image_bytes is None:
+        # Anything over twice MAX_IMAGE_PIXELS is rejected as a decompression bomb
+        monkeypatch.setattr(Image, 'MAX_IMAGE_PIXELS', 100)
+        buffer = io.BytesIO()
+        Image.new('RGB', (32, 32)).save(buffer, format='PNG')
+        image_bytes = buffer.getvalue()
+    service = ExplanationService(cache_dir=str(tmp_path))
+    service._ensure_loaded = lambda: None
+    service.checkpoint_hash = 'checkpoint-hash'
+
+    with pytest.raises(ValueError, match=message):
+        service.explain(image_bytes)
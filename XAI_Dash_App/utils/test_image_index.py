@@ -0,0 +1,136 @@
+import os
+import random
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from utils.explainer import hash_file
+from utils.image_index import ImageIndex, build_index
+
+
+class FakeExplainer:
+    """Returns fixed presence vectors and class scores per image file"""
+
+    def __init__(self, vectors, scores, checkpoint_hash='checkpoint-hash'):
+        self.vectors = vectors
+        self.scores = scores
+        self.checkpoint_hash = checkpoint_hash
+        self.class_names = ['Gadwall', 'Other']
+
+    def embed(self, image_paths):
+        names = [os.path.basename(path) for path in image_paths]
+        pooled = np.array([self.vectors[name] for name in names], dtype=np.float32)
+        out = np.array([[self.scores.get(name, 0.0), 0.0] for name in names], dtype=np.float32)
+        return pooled, out
+
+
+def touch_images(root, class_name, names):
+    folder = root / class_name
+    folder.mkdir(parents=True, exist_ok=True)
+    for name in names:
+        (folder / name).write_bytes(b'')
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    test_dir = tmp_path / 'train'
+    teaching_dir = tmp_path / 'visualization_results'
+    index_dir = tmp_path / 'index'
+    # 'teach.jpg' also sits in the test pool and must never be selected
+    touch_images(test_dir, 'Gadwall', ['close.jpg', 'far.jpg', 'middle.jpg', 'teach.jpg'])
+    touch_images(teaching_dir, 'Gadwall', ['teach.jpg', 'z_other.jpg'])
+    vectors = {
+        'teach.jpg': [1.0, 0.0],
+        'close.jpg': [0.9, 0.1],
+        'middle.jpg': [0.5, 0.5],
+        'far.jpg': [0.0, 1.0],
+        'z_other.jpg': [0.0, 1.0]
+    }
+    # Gadwall confidence is sigmoid(score): ~0.88, 0.5 and ~0.12
+    scores = {'close.jpg': 2.0, 'middle.jpg': 0.0, 'far.jpg': -2.0, 'teach.jpg': 2.0}
+    explainer = FakeExplainer(vectors, scores)
+    build_index(explainer, str(test_dir), str(teaching_dir), ['Gadwall'], str(index_dir))
+    return test_dir, teaching_dir, index_dir, explainer
+
+
+def test_similar_ranks_by_teaching_image(dataset):
+    _, _, index_dir, _ = dataset
+    index = ImageIndex(str(index_dir))
+
+    assert index.select('Gadwall', mode='similar', top_k=1) == ('Gadwall/close.jpg', 'similar')
+    picks = {index.select('Gadwall', mode='similar', top_k=2, rng=random.Random(i))[0] for i in range(50)}
+    assert picks == {'Gadwall/close.jpg', 'Gadwall/middle.jpg'}
+
+
+def test_confidence_band(dataset):
+    _, _, index_dir, _ = dataset
+    index = ImageIndex(str(index_dir))
+
+    assert index.select('Gadwall', mode='confidence', band=(0.3, 0.7)) == ('Gadwall/middle.jpg', 'confidence')
+    assert index.select('Gadwall', mode='confidence', band=(0.95, 0.99), top_k=1) == ('Gadwall/close.jpg', 'confidence_nearest')
+
+
+def test_similar_without_teaching_vector_falls_back_to_random(dataset):
+    _, _, index_dir, _ = dataset
+    os.remove(index_dir / 'teaching.npy')
+    index = ImageIndex(str(index_dir))
+
+    image_id, mode = index.select('Gadwall', mode='similar')
+    assert mode == 'random'
+    assert image_id in {'Gadwall/close.jpg', 'Gadwall/middle.jpg', 'Gadwall/far.jpg'}
+
+
+def test_teaching_image_is_never_selected(dataset):
+    _, _, index_dir, _ = dataset
+    index = ImageIndex(str(index_dir))
+
+    picks = {index.select('Gadwall', mode='random', rng=random.Random(i))[0] for i in range(100)}
+    assert picks == {'Gadwall/close.jpg', 'Gadwall/middle.jpg', 'Gadwall/far.jpg'}
+
+
+def test_unknown_class_selects_nothing(dataset):
+    _, _, index_dir, _ = dataset
+    assert ImageIndex(str(index_dir)).select('Henslow_Sparrow') == (None, None)
+
+
+def test_load_accepts_matching_checkpoint(dataset, tmp_path):
+    test_dir, _, index_dir, explainer = dataset
+    checkpoint = tmp_path / 'net_trained'
+    checkpoint.write_bytes(b'weights')
+    explainer.checkpoint_hash = hash_file(str(checkpoint))
+    build_index(explainer, str(test_dir), str(dataset[1]), ['Gadwall'], str(index_dir))
+
+    assert ImageIndex.load(str(index_dir), str(test_dir), str(checkpoint)) is not None
+
+
+def test_load_rejects_other_checkpoint(dataset, tmp_path):
+    test_dir, _, index_dir, _ = dataset
+    checkpoint = tmp_path / 'net_trained'
+    checkpoint.write_bytes(b'retrained weights')
+
+    assert ImageIndex.load(str(index_dir), str(test_dir), str(checkpoint)) is None
+
+
+def test_load_rejects_missing_images(dataset, tmp_path):
+    test_dir, _, index_dir, _ = dataset
+    os.remove(test_dir / 'Gadwall' / 'far.jpg')
+
+    assert ImageIndex.load(str(index_dir), str(test_dir), str(tmp_path / 'no_checkpoint')) is None
+
+
+@pytest.mark.parametrize('name', ['index.json', 'features.npy'])
+def test_load_rejects_missing_files(dataset, tmp_path, name):
+    test_dir, _, index_dir, _ = dataset
+    os.remove(index_dir / name)
+
+    assert ImageIndex.load(str(index_dir), str(test_dir), str(tmp_path / 'no_checkpoint')) is None
+
+
+def test_build_index_raises_on_empty_pool(tmp_path):
+    explainer = FakeExplainer({}, {})
+    index_dir = tmp_path / 'index'
+
+    with pytest.raises(ValueError, match='No test images'):
+        build_index(explainer, str(tmp_path / 'train'), str(tmp_path / 'vis'), ['Gadwall'], str(index_dir))
+    assert not os.path.exists(index_dir / 'index.json')
@@ -0,0 +1,175 @@
+import threading
+
+import pytest
+
+from utils.persistence import ResponseWriter
+
+
+class StubWriter(ResponseWriter):
+    """ResponseWriter with the CSV replaced by an in-memory dict"""
+
+    def __init__(self, disk=None, **kwargs):
+        self.writes = []
+        self.failures = 0
+        self.reads = 0
+        self.disk = dict(disk or {})
+        kwargs.setdefault('flush_interval', 60)
+        super().__init__('unused.csv', **kwargs)
+
+    def _write(self, records):
+        if self.failures:
+            self.failures -= 1
+            raise OSError('disk full')
+        self.writes.append(sorted(records, key=lambda r: r['class_name']))
+        for r in records:
+            self.disk[self._key(r)] = r
+        return list(self.disk.values())
+
+    def _read_rows(self, user_name):
+        self.reads += 1
+        return [r for r in self.disk.values() if r['user_name'] == user_name]
+
+
+def record(class_name, phase, user_name='alice'):
+    return {'class_name': class_name, 'user_name': user_name, 'teaching_phase': phase}
+
+
+@pytest.fixture
+def writer():
+    writer = StubWriter()
+    yield writer
+    writer.close()
+
+
+def test_flush_writes_latest_record_per_key(writer):
+    writer.enqueue([record('Gadwall', ''), record('Western_Meadowlark', '')])
+    writer.enqueue([record('Gadwall', 'control'), record('Western_Meadowlark', 'control')])
+    writer.flush()
+
+    assert writer.writes == [[record('Gadwall', 'control'), record('Western_Meadowlark', 'control')]]
+    stats = writer.stats()
+    assert stats['flushes'] == 1
+    assert stats['records_written'] == 2
+    assert stats['pending_records'] == 0
+    assert stats['queue_depth'] == 0
+
+
+def test_out_of_order_batches_keep_the_newer_record(writer):
+    # Simulate two callbacks whose puts land in the queue in reverse seq order
+    writer._pending[('Gadwall', 'alice')] = (2, record('Gadwall', 'new'))
+    writer._queue.put((2, [record('Gadwall', 'new')]))
+    writer._queue.put((1, [record('Gadwall', 'old')]))
+    writer.flush()
+
+    assert writer.writes == [[record('Gadwall', 'new')]]
+    assert writer.stats()['pending_records'] == 0
+
+
+def test_failed_write_is_retried(writer):
+    writer.failures = 1
+    writer.enqueue([record('Gadwall', 'control')])
+    writer.flush()
+
+    assert writer.writes == []
+    assert writer.stats()['errors'] == 1
+    assert writer.get_records('alice') == [record('Gadwall', 'control')]
+
+    writer.flush()
+    assert writer.writes == [[record('Gadwall', 'control')]]
+    assert writer.stats()['pending_records'] == 0
+
+
+def test_full_queue_flushes_in_the_caller():
+    writer = StubWriter(max_queue_size=1, enqueue_timeout=0.01)
+    writer.enqueue([record('Gadwall', 'control')])
+    writer.enqueue([record('Western_Meadowlark', 'control')])
+
+    assert writer.stats()['blocked_enqueues'] == 1
+    assert writer.writes == [[record('Gadwall', 'control')]]
+    writer.close()
+    assert writer.writes[-1] == [record('Western_Meadowlark', 'control')]
+
+
+def test_close_flushes_queued_records():
+    writer = StubWriter()
+    writer.enqueue([record('Gadwall', 'treatment1')])
+    writer.close()
+
+    assert writer.writes == [[record('Gadwall', 'treatment1')]]
+
+
+def test_get_records_only_returns_own_unflushed_writes(writer):
+    writer.enqueue([record('Gadwall', 'control', 'alice'), record('Gadwall', 'treatment2', 'bob')])
+
+    assert writer.get_records('alice') == [record('Gadwall', 'control', 'alice')]
+    assert writer.get_records('bob') == [record('Gadwall', 'treatment2', 'bob')]
+
+
+def test_get_records_during_a_flush_keeps_the_record(writer):
+    writing = threading.Event()
+    release = threading.Event()
+    write = writer._write
+
+    def slow_write(records):
+        writing.set()
+        release.wait(5)
+        return write(records)
+
+    writer._write = slow_write
+    writer.enqueue([record('Gadwall', 'control')])
+    flusher = threading.Thread(target=writer.flush)
+    flusher.start()
+    writing.wait(5)
+
+    assert writer.get_records('alice') == [record('Gadwall', 'control')]
+    release.set()
+    flusher.join(5)
+    assert writer.get_records('alice') == [record('Gadwall', 'control')]
+    assert writer.stats()['pending_records'] == 0
+
+
+def test_get_records_never_misses_while_flushing_concurrently(writer):
+    stop = threading.Event()
+
+    def flush_loop():
+        while not stop.is_set():
+            writer.flush()
+
+    flusher = threading.Thread(target=flush_loop)
+    flusher.start()
+    try:
+        for i in range(300):
+            writer.enqueue([record('Gadwall', f'phase{i}')])
+            assert writer.get_records('alice') == [record('Gadwall', f'phase{i}')]
+    finally:
+        stop.set()
+        flusher.join(5)
+    assert writer.reads == 0
+
+
+def test_get_records_loads_user_rows_after_a_restart():
+    disk = {('Gadwall', 'alice'): record('Gadwall', 'control'), ('Gadwall', 'bob'): record('Gadwall', '', 'bob')}
+    writer = StubWriter(disk=disk)
+
+    assert writer.get_records('alice') == [record('Gadwall', 'control')]
+    assert writer.get_records('alice') == [record('Gadwall', 'control')]
+    assert writer.reads == 1
+    writer.enqueue([record('Gadwall', 'treatment1')])
+    assert writer.get_records('alice') == [record('Gadwall', 'treatment1')]
+    writer.close()
+
+
+def test_csv_round_trip_after_a_restart(tmp_path):
+    pytest.importorskip('pandas')
+    csv_path = str(tmp_path / 'user_guesses.csv')
+    writer = ResponseWriter(csv_path, flush_interval=60)
+    writer.enqueue([record('Gadwall', ''), record('Gadwall', '', '42')])
+    writer.close()
+
+    restarted = ResponseWriter(csv_path, flush_interval=60)
+    assert restarted.get_records('alice') == [record('Gadwall', None)]
+    assert restarted.get_records('42') == [record('Gadwall', None, '42')]
+    restarted.enqueue([record('Gadwall', 'control')])
+    restarted.close()
+
+    assert ResponseWriter(csv_path, flush_interval=60).get_records('alice') == [record('Gadwall', 'control')]
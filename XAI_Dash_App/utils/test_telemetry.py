@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+pd = pytest.importorskip('pandas')
+
+from utils.utils import DataLogger, telemetry_summary
+
+DESKTOP = {'type': 'desktop', 'user_agent': 'test'}
+
+
+def latency(phase, response_ms, decoded_ms):
+    return {'type': 'next_latency', 'phase': phase, 'user_name': 'alice', 'button': 'next-btn',
+            'click_to_response_ms': response_ms, 'click_to_decoded_ms': decoded_ms}
+
+
+def exposure(gallery, visible_ms):
+    return {'type': 'gallery_exposure', 'phase': 'phase2', 'user_name': 'alice',
+            'gallery': gallery, 'visible_ms': visible_ms}
+
+
+@pytest.fixture
+def logger(tmp_path):
+    return DataLogger(str(tmp_path / 'logs'))
+
+
+def test_missing_log_gives_empty_frames(logger):
+    percentiles, exposures = telemetry_summary(logger.events_file)
+    assert percentiles.empty and exposures.empty
+
+
+def test_latency_only_log(logger):
+    logger.log_events('s1', [latency('phase1', 100, 150), latency('phase1', 200, 250)], device=DESKTOP)
+    percentiles, exposures = telemetry_summary(logger.events_file)
+
+    assert exposures.empty
+    assert percentiles.loc[('desktop', 'phase1'), ('click_to_decoded_ms', 0.5)] == pytest.approx(200)
+
+
+def test_null_decode_times_do_not_break_percentiles(logger):
+    # The last Next click renders no image, so both Phase 3 events have no decode time
+    logger.log_events('s1', [latency('phase3', 120, None), latency('phase3', 80, None)], device=DESKTOP)
+    percentiles, _ = telemetry_summary(logger.events_file)
+
+    assert percentiles.loc[('desktop', 'phase3'), ('click_to_response_ms', 0.5)] == pytest.approx(100)
+    assert pd.isna(percentiles.loc[('desktop', 'phase3'), ('click_to_decoded_ms', 0.5)])
+
+
+def test_exposure_only_log_without_device(logger):
+    logger.log_events('s1', [exposure('treatment1-content', 1000), exposure('treatment1-content', 500)], device=None)
+    percentiles, exposures = telemetry_summary(logger.events_file)
+
+    assert percentiles.empty
+    assert exposures.to_dict(orient='records') == [
+        {'session_id': 's1', 'user_name': 'alice', 'gallery': 'treatment1-content', 'visible_ms': 1500}
+    ]
+
+
+def test_latency_without_device_is_grouped_as_unknown(logger):
+    logger.log_events('s1', [latency('phase1', 100, 150)], device=None)
+    percentiles, _ = telemetry_summary(logger.events_file)
+
+    assert len(percentiles) == 1
+    assert percentiles[('click_to_decoded_ms', 0.5)].iloc[0] == pytest.approx(150)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    pytest.importorskip('dash')
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('XAI_STARTUP_MODE', 'lazy')
+    import app
+    monkeypatch.setattr(app, 'event_logger', DataLogger(str(tmp_path / 'events')))
+    return app, app.app.server.test_client()
+
+
+@pytest.mark.parametrize('payload', [[], 'events', {'events': 'not a list'}, {}])
+def test_telemetry_rejects_malformed_payloads(client, payload):
+    _, test_client = client
+    assert test_client.post('/telemetry', json=payload).status_code == 400
+
+
+def test_telemetry_truncates_large_batches(client):
+    app, test_client = client
+    events = [latency('phase1', i, i) for i in range(app.MAX_TELEMETRY_EVENTS + 50)] + ['not an event']
+    response = test_client.post('/telemetry', json={'session_id': 's1', 'device': DESKTOP, 'events': events})
+
+    assert response.status_code == 204
+    with open(app.event_logger.events_file) as f:
+        lines = [json.loads(line) for line in f]
+    assert len(lines) == app.MAX_TELEMETRY_EVENTS
+    assert lines[0]['session_id'] == 's1'
+    assert lines[0]['data']['device'] == DESKTOP
@@ -1,14 +1,15 @@
-import pandas as pd
-import numpy as np
 import os
 from datetime import datetime
 import json
+import threading
 
 class DataLogger:
     def __init__(self, log_dir='../data/logs'):
         self.log_dir = log_dir
         os.makedirs(log_dir, exist_ok=True)
         self.log_file = os.path.join(log_dir, f'study_logs_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx')
+        self.events_file = os.path.join(log_dir, f'study_events_{datetime.now().strftime("%Y%m%d_%H%M%S")}.jsonl')
+        self._events_lock = threading.Lock()
         
     def log_interaction(self, session_id, phase, event_type, data):
         """Log user interactions to Excel file"""
@@ -21,6 +22,8 @@ class DataLogger:
             'data': json.dumps(data)
         }
         
+        import pandas as pd
+
         # Create or append to Excel file
         if not os.path.exists(self.log_file):
             df = pd.DataFrame([log_data])
@@ -30,6 +33,27 @@ class DataLogger:
             df = pd.concat([df, pd.DataFrame([log_data])], ignore_index=True)
             df.to_excel(self.log_file, index=False)
 
+    def log_events(self, session_id, events, device=None):
+        """Append a batch of client events to the JSON lines event log"""
+        timestamp = datetime.now().isoformat()
+        lines = []
+        for event in events:
+            data = dict(event, device=device)
+            lines.append(json.dumps({
+                'session_id': session_id,
+                'timestamp': timestamp,
+                'phase': event.get('phase'),
+                'event_type': event.get('type'),
+                'data': data
+            }) + '\n')
+        with self._events_lock:
+            with open(self.events_file, 'a') as f:
+                f.writelines(lines)
+
+def list_jpg_files(folder):
+    """JPG file names in a folder, sorted so the first one is the same everywhere"""
+    return sorted(f for f in os.listdir(folder) if f.lower().endswith('.jpg'))
+
 def process_prediction_data(df):
     """Process the prediction data for display"""
     # Group by class_name and get top prototypes
@@ -49,6 +73,7 @@ def calculate_metrics(log_file):
     if not os.path.exists(log_file):
         return {}
     
+    import pandas as pd
     df = pd.read_excel(log_file)
     metrics = {
         'total_participants': df['session_id'].nunique(),
@@ -57,4 +82,37 @@ def calculate_metrics(log_file):
         'avg_clarity_rating': None  # To be implemented
     }
     
-    return metrics 
\ No newline at end of file
+    return metrics 
+
+def telemetry_summary(events_file):
+    """Latency percentiles per device type and gallery exposure per user from the event log"""
+    import pandas as pd
+
+    if not os.path.exists(events_file):
+        return pd.DataFrame(), pd.DataFrame()
+    df = pd.read_json(events_file, lines=True)
+    if df.empty:
+        return pd.DataFrame(), pd.DataFrame()
+
+    def events_of(event_type, columns):
+        # Normalise only this event type, and make sure its columns exist even if never sent
+        rows = df[df['event_type'] == event_type]
+        data = pd.json_normalize(rows['data'].tolist()).reindex(columns=columns)
+        data['session_id'] = rows['session_id'].to_numpy()
+        return data
+
+    latency_columns = ['click_to_response_ms', 'click_to_decoded_ms']
+    latency = events_of('next_latency', ['device.type', 'phase'] + latency_columns)
+    if latency.empty:
+        percentiles = pd.DataFrame()
+    else:
+        latency[latency_columns] = latency[latency_columns].apply(pd.to_numeric, errors='coerce')
+        percentiles = latency.groupby(['device.type', 'phase'], dropna=False)[latency_columns].quantile([0.5, 0.9, 0.99]).unstack()
+
+    exposure = events_of('gallery_exposure', ['user_name', 'gallery', 'visible_ms'])
+    if exposure.empty:
+        exposure = pd.DataFrame()
+    else:
+        exposure['visible_ms'] = pd.to_numeric(exposure['visible_ms'], errors='coerce')
+        exposure = exposure.groupby(['session_id', 'user_name', 'gallery'], dropna=False)['visible_ms'].sum().reset_index()
+    return percentiles, exposure